@@ -0,0 +1,228 @@
+"""
+Shared helpers for agent_bot.py and the small Telegram scripts (run_reminders.py,
+send_btc_gbp.py, send_hn_digest.py, send_photo_now.py): config and chat_id loading,
+the optional orjson shim, Bot API requests over pooled keep-alive HTTPS connections,
+and sendMessage. They import it as `_common`, which works because Python puts the
+script's own directory on sys.path.
+"""
+
+import io
+import gzip
+import os
+import json
+import shutil
+import threading
+import time
+import http.client
+import urllib.error
+
+try:
+    import orjson  # optional: faster JSON for API calls and agent output
+except ImportError:
+    orjson = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(SCRIPT_DIR, "config")
+CHAT_ID_FILE = os.path.join(SCRIPT_DIR, "chat_id")
+API_HOST = "api.telegram.org"
+BASE = "https://%s/bot" % API_HOST
+HTTP_POOL_SIZE = 4  # idle keep-alive connections kept open to API_HOST
+DEFAULT_AGENT_TIMEOUT = 0  # 0 = unlimited; set CURSOR_AGENT_TIMEOUT in config or env to limit
+SEND_INTERVAL = 1.0  # Telegram allows about one message per second to a chat
+
+_json_decode = json.JSONDecoder().decode  # bound once; skips json.loads' per-call argument checks
+
+
+def _stdlib_json_loads(data):
+    """Decode JSON from str or UTF-8 bytes with the bound stdlib decoder."""
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return _json_decode(data)
+
+
+json_loads = orjson.loads if orjson is not None else _stdlib_json_loads  # both accept str or bytes
+
+
+def json_dumps(obj):
+    """Encode obj as UTF-8 JSON bytes (orjson if installed, else stdlib json)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def read_small_file(path):
+    """
+    Return a small file's bytes using plain os.read, skipping the buffered/text file
+    objects and codec setup open() does; that setup dominates for files this size.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+    return b"".join(chunks)
+
+
+_CONFIG_CACHE = {"mtime": None, "data": {}}
+
+
+def parse_config():
+    """Parse CONFIG_FILE once into a dict of KEY -> value, re-reading only when its mtime changes."""
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        _CONFIG_CACHE["mtime"], _CONFIG_CACHE["data"] = None, {}
+        return {}
+    mtime = (st.st_mtime_ns, st.st_size)
+    if mtime == _CONFIG_CACHE["mtime"]:
+        return _CONFIG_CACHE["data"]
+    try:
+        text = read_small_file(CONFIG_FILE).decode("utf-8")
+    except (OSError, UnicodeDecodeError):
+        return {}  # not cached: a half-written or unreadable file is retried on the next call
+    data = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        k, sep, v = line.partition("=")
+        if not sep:
+            continue
+        v = v.strip()
+        if v and v[0] in "'\"" and v[-1] == v[0]:
+            v = v[1:-1]
+        if v:
+            data[k.strip()] = v
+    _CONFIG_CACHE["mtime"], _CONFIG_CACHE["data"] = mtime, data
+    return data
+
+
+def get_agent_timeout():
+    """Agent subprocess timeout in seconds. Config file or env CURSOR_AGENT_TIMEOUT, else default."""
+    timeout = None
+    v = parse_config().get("CURSOR_AGENT_TIMEOUT")
+    if v:
+        try:
+            timeout = int(v)
+        except ValueError:
+            pass
+    if timeout is None:
+        try:
+            timeout = int(os.environ.get("CURSOR_AGENT_TIMEOUT", str(DEFAULT_AGENT_TIMEOUT)))
+        except ValueError:
+            timeout = DEFAULT_AGENT_TIMEOUT
+    return timeout if timeout > 0 else 0  # 0 = unlimited
+
+
+def load_config():
+    """Return (token, chat_id) or (None, None) if missing."""
+    token = parse_config().get("TELEGRAM_BOT_TOKEN") or os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        return None, None
+    try:
+        chat_id = int(read_small_file(CHAT_ID_FILE))  # int() accepts bytes and ignores surrounding whitespace
+    except (ValueError, OSError):  # missing, unreadable or not a number
+        return token, None
+    return token, chat_id
+
+
+_http_pool = []  # idle http.client.HTTPSConnection objects, reused across calls and threads
+_http_pool_lock = threading.Lock()
+
+
+def http_request(method, path, body=None, headers=None, timeout=60, sink=None):
+    """
+    Send one request to API_HOST over a pooled keep-alive connection and return the body.
+    body may be bytes or a callable yielding chunks; with sink, the body is streamed into it.
+    """
+    headers = dict(headers or {})
+    if sink is None:
+        headers["Accept-Encoding"] = "gzip"
+    for attempt in range(2):
+        streaming = False
+        with _http_pool_lock:
+            conn = _http_pool.pop() if _http_pool else None
+        reused = conn is not None
+        if conn is None:
+            conn = http.client.HTTPSConnection(API_HOST, timeout=timeout)
+        else:
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+        try:
+            conn.request(method, path, body=body() if callable(body) else body, headers=headers)
+            resp = conn.getresponse()
+            if sink is not None and resp.status < 400:
+                streaming = True
+                shutil.copyfileobj(resp, sink, 65536)
+                data = b""
+            else:
+                data = resp.read()
+                if resp.getheader("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+        except (http.client.HTTPException, OSError, EOFError) as e:  # EOFError: truncated gzip body
+            conn.close()
+            retryable = isinstance(e, (ConnectionError, http.client.BadStatusLine))
+            if reused and attempt == 0 and retryable and not streaming:
+                continue
+            raise urllib.error.URLError(e)
+        if resp.will_close:
+            conn.close()
+        else:
+            with _http_pool_lock:
+                if len(_http_pool) < HTTP_POOL_SIZE:
+                    _http_pool.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        if resp.status >= 400:
+            url = "https://%s%s" % (API_HOST, path)
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+        return data
+
+
+def _post_json(path, payload, timeout=10):
+    """POST payload as JSON to API_HOST via http_request and return the decoded reply."""
+    return json_loads(http_request("POST", path, json_dumps(payload), {"Content-Type": "application/json"}, timeout))
+
+
+_next_send = {}  # chat_id -> time.monotonic() before which the next message must not go out
+_next_send_lock = threading.Lock()
+
+
+def _wait_send_slot(chat_id):
+    """Sleep until this chat's next send slot (SEND_INTERVAL apart) and claim it."""
+    with _next_send_lock:
+        now = time.monotonic()
+        slot = max(now, _next_send.get(chat_id, now))
+        _next_send[chat_id] = slot + SEND_INTERVAL
+    if slot > now:
+        time.sleep(slot - now)
+
+
+def send_message(token, chat_id, text):
+    """
+    Send text to chat_id, spacing messages to one chat SEND_INTERVAL apart so a burst of
+    sends doesn't hit Telegram's flood limit. A 429 is retried once after the
+    retry_after the API asks for.
+    """
+    path = "/bot%s/sendMessage" % token
+    payload = {"chat_id": chat_id, "text": text}
+    _wait_send_slot(chat_id)
+    try:
+        return _post_json(path, payload)
+    except urllib.error.HTTPError as e:
+        if e.code != 429:
+            raise
+        try:
+            retry_after = json_loads(e.read())["parameters"]["retry_after"]
+        except (ValueError, KeyError, TypeError):
+            retry_after = 1
+    time.sleep(retry_after)
+    _wait_send_slot(chat_id)
+    return _post_json(path, payload)
@@ -13,78 +13,58 @@ TELEGRAM_ALLOWED_USER_ID. Run from a terminal outside Cursor.
 
 import os
 import sys
+import atexit
 import time
 import json
+import secrets
+import selectors
 import subprocess
 import threading
-import urllib.request
+import urllib.parse
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
+
+from _common import (
+    CHAT_ID_FILE,
+    CONFIG_FILE,
+    SCRIPT_DIR,
+    get_agent_timeout,
+    http_request,
+    json_dumps,
+    json_loads,
+    parse_config,
+)
+
+TYPING_INTERVAL = 4.5  # Telegram typing indicator lasts ~5s; re-send before it expires
+CHAT_ACTION_MIN_GAP = 3.0  # drop a repeated chat action sent sooner than this
+DOWNLOAD_WORKERS = 4  # parallel photo/document downloads per batch
+MESSAGE_LIMIT = 4096  # max characters per Telegram sendMessage
+LONG_POLL_TIMEOUT = 50  # getUpdates long-poll seconds (Telegram recommends <= 50)
+ALLOWED_UPDATES = ["message", "edited_message"]  # the only update types main() handles
 
-TYPING_INTERVAL = 4  # Telegram typing indicator lasts ~5s; re-send before it expires
-DEFAULT_AGENT_TIMEOUT = 0  # 0 = unlimited; set CURSOR_AGENT_TIMEOUT in config or env to limit
-
-BASE = "https://api.telegram.org/bot"
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 REPO_ROOT = os.path.dirname(SCRIPT_DIR)
-CONFIG_FILE = os.path.join(SCRIPT_DIR, "config")
 SESSION_FILE = os.path.join(SCRIPT_DIR, ".cursor_agent_session")
-CHAT_ID_FILE = os.path.join(SCRIPT_DIR, "chat_id")
 OFFSET_FILE = os.path.join(SCRIPT_DIR, ".telegram_offset")
 RECEIVED_IMAGES_DIR = os.path.join(SCRIPT_DIR, "received_images")
 RECEIVED_DOCUMENTS_DIR = os.path.join(SCRIPT_DIR, "received_documents")
 LOGS_DIR = os.path.join(SCRIPT_DIR, "logs")
 PENDING_IMAGES_DIR = os.path.join(SCRIPT_DIR, "pending_images")
 PENDING_ATTACHMENTS_DIR = os.path.join(SCRIPT_DIR, "pending_attachments")
-
-
-def get_agent_timeout() -> int:
-    """Agent subprocess timeout in seconds. Config file or env CURSOR_AGENT_TIMEOUT, else default."""
-    timeout = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "CURSOR_AGENT_TIMEOUT" and v:
-                        try:
-                            timeout = int(v)
-                        except ValueError:
-                            pass
-                        break
-    if timeout is None:
-        try:
-            timeout = int(os.environ.get("CURSOR_AGENT_TIMEOUT", str(DEFAULT_AGENT_TIMEOUT)))
-        except ValueError:
-            timeout = DEFAULT_AGENT_TIMEOUT
-    return timeout if timeout > 0 else 0  # 0 = unlimited
+_RECEIVED_DIRS = (RECEIVED_IMAGES_DIR, RECEIVED_DOCUMENTS_DIR)
 
 
 def load_config() -> Tuple[str, int]:
     """Load TELEGRAM_BOT_TOKEN and TELEGRAM_ALLOWED_USER_ID from config file or env."""
-    token = None
+    cfg = parse_config()
+    token = cfg.get("TELEGRAM_BOT_TOKEN")
     user_id = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "TELEGRAM_BOT_TOKEN" and v:
-                        token = v
-                    elif k == "TELEGRAM_ALLOWED_USER_ID" and v:
-                        try:
-                            user_id = int(v)
-                        except ValueError:
-                            pass
+    if cfg.get("TELEGRAM_ALLOWED_USER_ID"):
+        try:
+            user_id = int(cfg["TELEGRAM_ALLOWED_USER_ID"])
+        except ValueError:
+            pass
     token = token or os.environ.get("TELEGRAM_BOT_TOKEN")
     if not token:
         print("Set TELEGRAM_BOT_TOKEN in %s or env." % CONFIG_FILE, file=sys.stderr)
@@ -103,16 +83,40 @@ def load_config() -> Tuple[str, int]:
 
 
 def api(token, method, **params):
-    url = f"{BASE}{token}/{method}"
-    data = json.dumps(params).encode() if params else None
-    req = urllib.request.Request(url, data=data, method="POST" if data else "GET")
-    if data:
-        req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=60) as r:
-        return json.loads(r.read().decode())
+    path = "/bot%s/%s" % (token, method)
+    if params:
+        data = http_request("POST", path, json_dumps(params), {"Content-Type": "application/json"})
+    else:
+        data = http_request("GET", path)
+    return json_loads(data)
+
+
+def api_get(token, method, **params):
+    """
+    Call a read-only Bot API method (getUpdates, getFile) as a GET with params in the
+    query string, skipping the JSON request body. Non-string values are JSON-encoded,
+    as the Bot API expects for e.g. allowed_updates. The socket timeout leaves room
+    for a long-poll "timeout" param.
+    """
+    path = "/bot%s/%s" % (token, method)
+    if params:
+        path += "?" + urllib.parse.urlencode(
+            {k: v if isinstance(v, str) else json.dumps(v) for k, v in params.items()}
+        )
+    return json_loads(http_request("GET", path, timeout=max(60, params.get("timeout", 0) + 20)))
+
+
+_last_chat_action = {}  # (chat_id, action) -> time.monotonic() of last send
+_last_message_sent = {}  # chat_id -> time.monotonic() of last message/photo/document delivered
 
 
 def send_chat_action(token, chat_id, action="typing"):
+    """Send a chat action, skipping it if the same one went to this chat within CHAT_ACTION_MIN_GAP."""
+    now = time.monotonic()
+    key = (chat_id, action)
+    if now - _last_chat_action.get(key, float("-inf")) < CHAT_ACTION_MIN_GAP:
+        return
+    _last_chat_action[key] = now
     try:
         api(token, "sendChatAction", chat_id=chat_id, action=action)
     except Exception:
@@ -137,41 +141,138 @@ def collapse_blank_lines(text: str) -> str:
     return "\n".join(result)
 
 
+def _split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Split text into chunks of at most limit chars, breaking at the last newline in
+    each window so Markdown spans and code fences aren't cut in half (a cut span makes
+    Telegram reject parse_mode and costs a second request). Breaks must keep at least
+    half the window: failing a newline, the last space, failing that a hard split.
+    The newline or space broken at is dropped; whitespace-only chunks are dropped.
+    """
+    parts = []
+    i = 0
+    while len(text) - i > limit:
+        end = i + limit
+        floor = i + limit // 2  # a break earlier than this would waste a sendMessage on a short chunk
+        cut = text.rfind("\n", floor, end + 1)
+        if cut < i:
+            cut = text.rfind(" ", floor, end + 1)
+        if cut < i:
+            parts.append(text[i:end])
+            i = end
+        else:
+            parts.append(text[i:cut])
+            i = cut + 1
+    parts.append(text[i:])
+    return [p for p in parts if p.strip()]
+
+
+def _markdown_ok(text: str) -> bool:
+    """
+    Cheap local check that Telegram's legacy Markdown parser will accept text: every
+    *bold*, _italic_, `code`, ```pre``` and [link](url) entity is closed. Entities
+    don't nest, so markers inside one are literal; a backslash escapes _ * ` [.
+    """
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "\\" and i + 1 < n and text[i + 1] in "_*`[":
+            i += 2
+            continue
+        if c == "`" and text.startswith("```", i):
+            end = text.find("```", i + 3)
+            if end < 0:
+                return False
+            i = end + 3
+        elif c in "*_`":
+            end = text.find(c, i + 1)
+            if end < 0:
+                return False
+            i = end + 1
+        elif c == "[":
+            end = text.find("]", i + 1)
+            if end < 0:
+                return False
+            if text.startswith("(", end + 1):
+                end = text.find(")", end + 2)
+                if end < 0:
+                    return False
+            i = end + 1
+        else:
+            i += 1
+    return True
+
+
 def send_message(token, chat_id, text, parse_mode="Markdown"):
-    chunk = 4096
-    for i in range(0, len(text), chunk):
-        part = text[i : i + chunk]
-        try:
-            api(token, "sendMessage", chat_id=chat_id, text=part, parse_mode=parse_mode)
-        except urllib.error.HTTPError as e:
-            if e.code == 400 and parse_mode:
-                api(token, "sendMessage", chat_id=chat_id, text=part)
-            else:
-                raise
+    for part in _split_message(text):
+        mode = parse_mode
+        if mode == "Markdown" and not _markdown_ok(part):
+            mode = None  # Telegram would answer 400; skip that round trip and send plain text
+        if not mode:
+            api(token, "sendMessage", chat_id=chat_id, text=part)
+        else:
+            try:
+                api(token, "sendMessage", chat_id=chat_id, text=part, parse_mode=mode)
+            except urllib.error.HTTPError as e:
+                if e.code == 400:
+                    api(token, "sendMessage", chat_id=chat_id, text=part)
+                else:
+                    raise
+        _last_message_sent[chat_id] = time.monotonic()
+
+
+_MULTIPART_HEAD = (
+    b"--%s\r\n"
+    b"Content-Disposition: form-data; name=\"chat_id\"\r\n\r\n%s\r\n"
+    b"--%s\r\n"
+    b"Content-Disposition: form-data; name=\"%s\"; filename=\"%s\"\r\n"
+    b"Content-Type: %s\r\n\r\n"
+)
+# Escape a filename for a quoted multipart parameter the way browsers do (WHATWG HTML form encoding)
+_FILENAME_ESCAPES = str.maketrans({'"': "%22", "\r": "%0D", "\n": "%0A"})
+
+
+def _post_file(token, method: str, chat_id, field: str, path: str, filename: str, content_type: str) -> None:
+    """
+    POST a local file as multipart/form-data, streaming it from disk in 64 KiB chunks
+    (Content-Length precomputed) instead of building the whole body in memory.
+    """
+    boundary = b"----FormBoundary" + secrets.token_urlsafe(12).encode()
+    head = _MULTIPART_HEAD % (
+        boundary,
+        str(chat_id).encode(),
+        boundary,
+        field.encode(),
+        filename.translate(_FILENAME_ESCAPES).encode("utf-8", "surrogateescape"),
+        content_type.encode(),
+    )
+    tail = b"\r\n--%s--\r\n" % boundary
+
+    def body():
+        yield head
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                yield chunk
+        yield tail
+
+    headers = {
+        "Content-Type": "multipart/form-data; boundary=%s" % boundary.decode(),
+        "Content-Length": str(len(head) + os.path.getsize(path) + len(tail)),
+    }
+    http_request("POST", "/bot%s/%s" % (token, method), body, headers, timeout=30)
+    _last_message_sent[chat_id] = time.monotonic()
 
 
 def send_photo(token, chat_id, photo_path: str, caption: Optional[str] = None) -> None:
     """Send a local file as a photo. photo_path must be absolute or relative to cwd."""
     if not os.path.isfile(photo_path):
         return
-    url = f"{BASE}{token}/sendPhoto"
-    with open(photo_path, "rb") as f:
-        photo_data = f.read()
-    boundary = "----FormBoundary" + os.urandom(16).hex()
-    head = (
-        f"--{boundary}\r\n"
-        f"Content-Disposition: form-data; name=\"chat_id\"\r\n\r\n{chat_id}\r\n"
-        f"--{boundary}\r\n"
-        f"Content-Disposition: form-data; name=\"photo\"; filename=\"image.png\"\r\n"
-        f"Content-Type: image/png\r\n\r\n"
-    ).encode()
-    tail = f"\r\n--{boundary}--\r\n".encode()
-    body = head + photo_data + tail
-    req = urllib.request.Request(url, data=body, method="POST")
-    req.add_header("Content-Type", f"multipart/form-data; boundary={boundary}")
     try:
-        with urllib.request.urlopen(req, timeout=30) as r:
-            json.loads(r.read().decode())
+        _post_file(token, "sendPhoto", chat_id, "photo", photo_path, "image.png", "image/png")
     except Exception:
         pass
 
@@ -180,105 +281,141 @@ def send_document(token, chat_id, file_path: str) -> None:
     """Send a local file as a document."""
     if not os.path.isfile(file_path):
         return
-    url = f"{BASE}{token}/sendDocument"
-    with open(file_path, "rb") as f:
-        file_data = f.read()
     name = os.path.basename(file_path)
-    boundary = "----FormBoundary" + os.urandom(16).hex()
-    head = (
-        f"--{boundary}\r\n"
-        f"Content-Disposition: form-data; name=\"chat_id\"\r\n\r\n{chat_id}\r\n"
-        f"--{boundary}\r\n"
-        f"Content-Disposition: form-data; name=\"document\"; filename=\"{name}\"\r\n"
-        f"Content-Type: application/octet-stream\r\n\r\n"
-    ).encode()
-    tail = f"\r\n--{boundary}--\r\n".encode()
-    body = head + file_data + tail
-    req = urllib.request.Request(url, data=body, method="POST")
-    req.add_header("Content-Type", f"multipart/form-data; boundary={boundary}")
     try:
-        with urllib.request.urlopen(req, timeout=30) as r:
-            json.loads(r.read().decode())
+        _post_file(token, "sendDocument", chat_id, "document", file_path, name, "application/octet-stream")
     except Exception:
         pass
 
 
-def send_pending_images(token, chat_id) -> None:
-    """Send any images in PENDING_IMAGES_DIR as photos, then delete them."""
-    if not os.path.isdir(PENDING_IMAGES_DIR):
-        return
+_IMAGE_EXTENSIONS = frozenset((".png", ".jpg", ".jpeg", ".gif", ".webp"))
+
+
+_pending_empty_mtime = {}  # directory -> st_mtime_ns at which it was last scanned and found empty
+
+
+def _pending_files(directory: str) -> List[os.DirEntry]:
+    """
+    Regular files in directory as os.DirEntry objects sorted by name ([] if it is
+    missing). is_file() uses the type from the directory read, so no stat per file.
+    Adding or removing a file changes the directory's mtime, so while it still has
+    the mtime of a scan that came back empty, one stat replaces the scan.
+    """
     try:
-        for name in sorted(os.listdir(PENDING_IMAGES_DIR)):
-            path = os.path.join(PENDING_IMAGES_DIR, name)
-            if not os.path.isfile(path):
-                continue
-            lower = name.lower()
-            if not (lower.endswith(".png") or lower.endswith(".jpg") or lower.endswith(".jpeg") or lower.endswith(".gif") or lower.endswith(".webp")):
-                continue
-            try:
-                send_photo(token, chat_id, path)
-            except Exception:
-                pass
-            try:
-                os.unlink(path)
-            except OSError:
-                pass
+        mtime = os.stat(directory).st_mtime_ns
+        if _pending_empty_mtime.get(directory) == mtime:
+            return []
+        with os.scandir(directory) as it:
+            entries = sorted((e for e in it if e.is_file()), key=lambda e: e.name)
     except OSError:
-        pass
+        return []
+    # Like git's "racy" check: a file added within the same timestamp tick as the last
+    # change wouldn't move the mtime, so only trust mtimes at least a second old.
+    if not entries and time.time_ns() - mtime > 1_000_000_000:
+        _pending_empty_mtime[directory] = mtime
+    return entries
 
 
-_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+def send_pending_images(token, chat_id) -> None:
+    """Send any images in PENDING_IMAGES_DIR as photos, then delete them."""
+    for entry in _pending_files(PENDING_IMAGES_DIR):
+        if os.path.splitext(entry.name)[1].lower() not in _IMAGE_EXTENSIONS:
+            continue
+        try:
+            send_photo(token, chat_id, entry.path)
+        except Exception:
+            pass
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
 
 
 def send_pending_attachments(token, chat_id) -> None:
     """Send any files in PENDING_ATTACHMENTS_DIR (images as photo, others as document), then delete them."""
-    if not os.path.isdir(PENDING_ATTACHMENTS_DIR):
+    for entry in _pending_files(PENDING_ATTACHMENTS_DIR):
+        try:
+            if os.path.splitext(entry.name)[1].lower() in _IMAGE_EXTENSIONS:
+                send_photo(token, chat_id, entry.path)
+            else:
+                send_document(token, chat_id, entry.path)
+        except Exception:
+            pass
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+_last_saved = {}  # state file path -> value last written (or loaded) by this process
+
+
+def _write_state_file(path: str, value: str, fsync: bool = True) -> None:
+    """
+    Atomically replace a small state file (temp sibling + os.replace); no-op if value is
+    unchanged. With fsync the new contents are on disk before the rename, so a power
+    loss leaves either the old value or the new one, never an empty file.
+    """
+    if _last_saved.get(path) == value:
         return
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(value)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _last_saved[path] = value
+
+
+def _sync_state_file(path: str) -> None:
+    """fsync a state file written with fsync=False (e.g. at exit)."""
     try:
-        for name in sorted(os.listdir(PENDING_ATTACHMENTS_DIR)):
-            path = os.path.join(PENDING_ATTACHMENTS_DIR, name)
-            if not os.path.isfile(path):
-                continue
-            lower = name.lower()
-            try:
-                if any(lower.endswith(ext) for ext in _IMAGE_EXTENSIONS):
-                    send_photo(token, chat_id, path)
-                else:
-                    send_document(token, chat_id, path)
-            except Exception:
-                pass
-            try:
-                os.unlink(path)
-            except OSError:
-                pass
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
     except OSError:
         pass
+    finally:
+        os.close(fd)
 
 
 def load_session() -> Optional[str]:
-    if os.path.isfile(SESSION_FILE):
-        try:
-            with open(SESSION_FILE) as f:
-                return f.read().strip() or None
-        except Exception:
-            pass
-    return None
+    try:
+        with open(SESSION_FILE) as f:
+            session_id = f.read().strip() or None
+    except Exception:  # usually FileNotFoundError: no session yet
+        return None
+    if session_id:
+        _last_saved[SESSION_FILE] = session_id
+    return session_id
 
 
 def save_session(session_id: Optional[str]) -> None:
     if session_id:
         try:
-            with open(SESSION_FILE, "w") as f:
-                f.write(session_id)
+            _write_state_file(SESSION_FILE, session_id)
         except Exception as e:
             print("Could not save session: %s" % e, file=sys.stderr)
 
 
+def load_chat_id() -> Optional[int]:
+    """Load the persisted chat_id so an unchanged value isn't rewritten on every batch."""
+    try:
+        with open(CHAT_ID_FILE) as f:
+            chat_id = int(f.read().strip())
+    except (ValueError, OSError):  # missing, unreadable or not a number
+        return None
+    _last_saved[CHAT_ID_FILE] = str(chat_id)
+    return chat_id
+
+
 def save_chat_id(chat_id: int) -> None:
     """Persist chat_id so run_reminders.py can send scheduled messages to the user."""
     try:
-        with open(CHAT_ID_FILE, "w") as f:
-            f.write(str(chat_id))
+        _write_state_file(CHAT_ID_FILE, str(chat_id))
     except Exception as e:
         print("Could not save chat_id: %s" % e, file=sys.stderr)
 
@@ -296,19 +433,24 @@ def _safe_document_filename(name: str) -> str:
 def download_telegram_file(token: str, file_id: str, dest_path: str) -> bool:
     """Download a Telegram file by file_id to dest_path. Returns True on success."""
     try:
-        out = api(token, "getFile", file_id=file_id)
+        out = api_get(token, "getFile", file_id=file_id)
         if not out.get("ok"):
             return False
         file_path = (out.get("result") or {}).get("file_path")
         if not file_path:
             return False
-        url = "https://api.telegram.org/file/bot%s/%s" % (token, file_path)
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=120) as r:
-            data = r.read()
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        with open(dest_path, "wb") as f:
-            f.write(data)
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir not in _RECEIVED_DIRS:  # those are created once in main()
+            os.makedirs(dest_dir, exist_ok=True)
+        try:
+            with open(dest_path, "wb") as f:
+                http_request("GET", "/file/bot%s/%s" % (token, file_path), timeout=120, sink=f)
+        except BaseException:
+            try:
+                os.unlink(dest_path)  # don't leave a truncated file behind
+            except OSError:
+                pass
+            raise
         return True
     except Exception as e:
         print("Download file failed: %s" % e, file=sys.stderr)
@@ -322,58 +464,119 @@ def download_telegram_photo(token: str, file_id: str, dest_path: str) -> bool:
 
 def load_offset() -> int:
     """Load last getUpdates offset so restarts don't re-process the same message."""
-    if os.path.isfile(OFFSET_FILE):
-        try:
-            with open(OFFSET_FILE) as f:
-                return int(f.read().strip())
-        except (ValueError, OSError):
-            pass
-    return 0
+    try:
+        with open(OFFSET_FILE) as f:
+            offset = int(f.read().strip())
+    except (ValueError, OSError):  # missing on first run, or unreadable
+        return 0
+    _last_saved[OFFSET_FILE] = str(offset)
+    return offset
 
 
 def save_offset(offset: int) -> None:
-    """Persist getUpdates offset so a crash during agent run doesn't cause re-processing."""
+    """
+    Persist getUpdates offset so a crash during agent run doesn't cause re-processing.
+    Written every batch, so it isn't fsynced each time (a bot crash still sees it via the
+    page cache); main() registers an atexit hook that syncs it on shutdown.
+    """
     try:
-        with open(OFFSET_FILE, "w") as f:
-            f.write(str(offset))
+        _write_state_file(OFFSET_FILE, str(offset), fsync=False)
     except Exception as e:
         print("Could not save offset: %s" % e, file=sys.stderr)
 
 
-def _parse_session_and_final_output(full_stdout: str, full_stderr: str, returncode: int) -> Tuple[str, Optional[str]]:
-    """Parse full stdout for session_id and final displayable result. Returns (response_text, session_id)."""
-    session_id = None
-    response_text = None
-    for line in full_stdout.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            obj = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-        sid = obj.get("session_id") or obj.get("sessionId") or obj.get("chatId")
-        if sid:
-            session_id = str(sid)
-        if "result" in obj and isinstance(obj["result"], str):
-            response_text = obj["result"].strip()
-        elif response_text is None:
-            for key in ("text", "content", "response", "message", "output"):
-                if key in obj and isinstance(obj[key], str):
-                    response_text = obj[key]
-                    break
-    if response_text is None and full_stdout:
-        try:
-            obj = json.loads(full_stdout.strip().split("\n")[-1] or "{}")
-            session_id = session_id or obj.get("session_id") or obj.get("sessionId")
-            response_text = obj.get("result") or obj.get("text") or obj.get("content") or full_stdout
-            if isinstance(response_text, dict):
-                response_text = response_text.get("content", str(response_text))
-        except (json.JSONDecodeError, IndexError):
-            response_text = full_stdout
-    if returncode != 0 and not response_text:
-        response_text = full_stderr or "Agent exited with code %s" % returncode
-    return response_text or "(no output)", session_id
+class _TypingPinger(threading.Thread):
+    """
+    Re-send the typing indicator every TYPING_INTERVAL seconds until stop() is called.
+    While replies are streaming the messages themselves show progress, so a ping is
+    only sent once TYPING_INTERVAL has passed since the last message to the chat.
+    """
+
+    def __init__(self, token: str, chat_id: int):
+        super().__init__(daemon=True)
+        self.token = token
+        self.chat_id = chat_id
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            idle = time.monotonic() - _last_message_sent.get(self.chat_id, float("-inf"))
+            if idle >= TYPING_INTERVAL:
+                send_chat_action(self.token, self.chat_id, "typing")
+                idle = 0
+            if self.stop_event.wait(TYPING_INTERVAL - idle):
+                return
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
+
+
+# Sends the agent's replies. One worker, so they reach Telegram in order while the stdout
+# reader carries on parsing instead of waiting out each sendMessage round trip.
+_outbox = ThreadPoolExecutor(max_workers=1, thread_name_prefix="send")
+
+
+def _deliver_reply(token, chat_id, text: str, with_attachments: bool = True) -> None:
+    """Send pending attachments/images (if with_attachments), then text. Runs on _outbox."""
+    try:
+        if with_attachments:
+            send_pending_attachments(token, chat_id)
+            send_pending_images(token, chat_id)
+        send_message(token, chat_id, text)
+    except Exception as e:
+        print("Could not send reply: %s" % e, file=sys.stderr)
+
+
+# Runs each agent's stdout reader; threads are reused across batches. Two workers so a
+# reader still draining a killed agent (e.g. a grandchild holding the pipe) can't
+# hold up the next message.
+_agent_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="agent")
+
+
+def _iter_stdout_lines(proc, stderr_chunks: Optional[list] = None, stdout_log=None):
+    """
+    Yield complete stdout lines (bytes, newline included) from proc while draining its
+    stderr into stderr_chunks (discarded if None). One selector watches both pipes, so a burst of events
+    costs a single os.read and a chatty stderr can't fill its pipe and stall the agent.
+    If stdout_log (a binary file) is given, each stdout chunk is written to it as read.
+    """
+    sel = selectors.DefaultSelector()
+    for pipe in (proc.stdout, proc.stderr):
+        os.set_blocking(pipe.fileno(), False)
+        sel.register(pipe.fileno(), selectors.EVENT_READ)
+    out_fd = proc.stdout.fileno()
+    buf = bytearray()
+    try:
+        while sel.get_map():
+            for key, _ in sel.select():
+                try:
+                    chunk = os.read(key.fd, 65536)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    sel.unregister(key.fd)
+                elif key.fd != out_fd:
+                    if stderr_chunks is not None:
+                        stderr_chunks.append(chunk)
+                else:
+                    if stdout_log is not None:
+                        stdout_log.write(chunk)
+                    buf += chunk
+                    start = 0
+                    nl = buf.find(b"\n")
+                    while nl >= 0:
+                        yield bytes(buf[start : nl + 1])
+                        start = nl + 1
+                        nl = buf.find(b"\n", start)
+                    del buf[:start]
+        if buf:
+            yield bytes(buf)
+    finally:
+        sel.close()
+
+
+_SESSION_ID_KEYS = (b'"session_id"', b'"sessionId"', b'"chatId"')  # stream-json keys that may carry the session id
 
 
 def run_agent_streaming(
@@ -381,12 +584,14 @@ def run_agent_streaming(
     resume_session: Optional[str],
     token: str,
     chat_id: int,
+    timeout_sec: int = 0,
 ) -> Optional[str]:
     """
     Run cursor agent with stream-json: ignore "thinking" and "result". Send
     every assistant message as a Telegram message (no --stream-partial-output,
     so each message is a full turn). Skip whitespace-only. Typing indicator
     until process done. Raw JSON stream written to telegram-bot/logs/<timestamp>.log.
+    timeout_sec (0 = unlimited) is resolved by the caller from the cached config.
     Returns session_id for persistence.
     """
     if not prompt.strip():
@@ -401,120 +606,111 @@ def run_agent_streaming(
     if resume_session:
         cmd.extend(["--resume", resume_session])
     cmd.append(prompt)
-    timeout_sec = get_agent_timeout()
-    full_stdout_lines = []
-    full_stderr_lines = []
-    lock = threading.Lock()
-    process_done = threading.Event()
-    proc_ref = [None]  # so main thread can kill on timeout
+    # session_id is picked up from events as they are decoded; the raw stream only goes to the log
+    state = {"session_id": None}
 
     os.makedirs(LOGS_DIR, exist_ok=True)
     log_name = datetime.now().strftime("%Y-%m-%dT%H-%M-%S") + ".log"
     log_path = os.path.join(LOGS_DIR, log_name)
 
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            cwd=REPO_ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+    except Exception as e:
+        send_message(token, chat_id, "Error running agent: %s" % e)
+        return resume_session
+
     def reader():
         try:
-            proc = subprocess.Popen(
-                cmd,
-                cwd=REPO_ROOT,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-            )
-            proc_ref[0] = proc
-            try:
-                with open(log_path, "w") as logf:
-                    for line in iter(proc.stdout.readline, ""):
-                        with lock:
-                            full_stdout_lines.append(line)
-                        logf.write(line)
-                        logf.flush()
-                        line_stripped = line.strip()
-                        if not line_stripped:
-                            continue
-                        try:
-                            obj = json.loads(line_stripped)
-                        except json.JSONDecodeError:
-                            continue
-                        msg_type = (obj.get("role") or obj.get("type") or obj.get("messageType") or "").lower()
-                        if msg_type == "thinking":
-                            continue
-                        if msg_type == "result":
-                            continue
-                        if msg_type != "assistant":
-                            continue
-                        # Stream-json: text in message.content[].text
-                        text = None
-                        msg = obj.get("message")
-                        if isinstance(msg, dict):
-                            content = msg.get("content")
-                            if isinstance(content, list):
-                                parts = []
-                                for item in content:
-                                    if isinstance(item, dict) and item.get("type") == "text" and "text" in item:
-                                        parts.append(item["text"])
-                                if parts:
-                                    text = "".join(parts)
-                        if text is None:
-                            text = (
-                                obj.get("content")
-                                or obj.get("text")
-                                or obj.get("delta")
-                                or obj.get("result")
-                                or obj.get("output")
-                            )
-                        if not isinstance(text, str):
-                            continue
-                        to_send = text.strip()
-                        if to_send:
-                            send_pending_attachments(token, chat_id)
-                            send_pending_images(token, chat_id)
-                            send_message(token, chat_id, collapse_blank_lines(to_send))
-            finally:
-                proc.wait()
-                err = proc.stderr.read() if proc.stderr else ""
-                if err:
-                    full_stderr_lines.append(err)
+            # Unbuffered: the log gets one write(2) per pipe read rather than a write+flush per event
+            with open(log_path, "wb", buffering=0) as logf:
+                for line in _iter_stdout_lines(proc, None, logf):
+                    line_stripped = line.strip()
+                    if not line_stripped:
+                        continue
+                    # Decode assistant events (forwarded), the final result and, until one is
+                    # known, events carrying a session id; skip tool calls, thinking, etc.
+                    if not (
+                        b"assistant" in line_stripped.lower()
+                        or b'"result"' in line_stripped
+                        or (state["session_id"] is None and any(k in line_stripped for k in _SESSION_ID_KEYS))
+                    ):
+                        continue
+                    try:
+                        obj = json_loads(line_stripped)
+                    except ValueError:  # JSONDecodeError, or UnicodeDecodeError on non-UTF-8 bytes
+                        continue
+                    if not isinstance(obj, dict):
+                        continue
+                    sid = obj.get("session_id") or obj.get("sessionId") or obj.get("chatId")
+                    if sid:
+                        state["session_id"] = str(sid)
+                    msg_type = (obj.get("role") or obj.get("type") or obj.get("messageType") or "").lower()
+                    if msg_type == "thinking":
+                        continue
+                    if msg_type == "result":
+                        continue
+                    if msg_type != "assistant":
+                        continue
+                    # Stream-json: text in message.content[].text
+                    text = None
+                    msg = obj.get("message")
+                    if isinstance(msg, dict):
+                        content = msg.get("content")
+                        if isinstance(content, list):
+                            parts = []
+                            for item in content:
+                                if isinstance(item, dict) and item.get("type") == "text" and "text" in item:
+                                    parts.append(item["text"])
+                            if parts:
+                                text = "".join(parts)
+                    if text is None:
+                        text = (
+                            obj.get("content")
+                            or obj.get("text")
+                            or obj.get("delta")
+                            or obj.get("result")
+                            or obj.get("output")
+                        )
+                    if not isinstance(text, str):
+                        continue
+                    to_send = text.strip()
+                    if to_send:
+                        _outbox.submit(_deliver_reply, token, chat_id, collapse_blank_lines(to_send))
         except Exception as e:
-            send_message(token, chat_id, "Error running agent: %s" % e)
+            _outbox.submit(_deliver_reply, token, chat_id, "Error running agent: %s" % e, False)
         finally:
-            process_done.set()
-
-    t = threading.Thread(target=reader, daemon=False)
-    t.start()
-    last_typing = 0.0
-    start_time = time.time()
-    timed_out = False
-
-    while not process_done.is_set():
-        time.sleep(1)
-        now = time.time()
-        if timeout_sec and (now - start_time) >= timeout_sec:
-            p = proc_ref[0]
-            if p and p.poll() is None:
-                p.kill()
-            send_message(token, chat_id, "Agent timed out after %s seconds." % timeout_sec)
-            timed_out = True
-            break
-        if now - last_typing >= TYPING_INTERVAL:
-            send_chat_action(token, chat_id, "typing")
-            last_typing = now
-
-    t.join(timeout=10)
-    full_stdout = "".join(full_stdout_lines)
-    full_stderr = "".join(full_stderr_lines)
-    response_text, session_id = _parse_session_and_final_output(full_stdout, full_stderr, 0)
-    if not session_id:
-        session_id = resume_session
-    return session_id
+            proc.wait()
+
+    pinger = _TypingPinger(token, chat_id)
+    pinger.start()
+    fut = _agent_pool.submit(reader)
+    done, _ = wait([fut], timeout=timeout_sec or None)
+    pinger.stop()
+    if not done:
+        if proc.poll() is None:
+            proc.kill()
+        _outbox.submit(_deliver_reply, token, chat_id, "Agent timed out after %s seconds." % timeout_sec, False)
+
+    wait([fut], timeout=10)
+    _outbox.submit(lambda: None).result()  # barrier: every queued reply has been sent
+    return state["session_id"] or resume_session
 
 
 def main():
     token, allowed_user_id = load_config()
+    for d in _RECEIVED_DIRS:
+        os.makedirs(d, exist_ok=True)
     offset = load_offset()
+    atexit.register(_sync_state_file, OFFSET_FILE)
     if offset:
         print("Resuming from update offset %s." % offset, file=sys.stderr)
+    load_chat_id()
     session_id = load_session()
     if session_id:
         print("Resuming session: %s..." % session_id[:20], file=sys.stderr)
@@ -522,7 +718,10 @@ def main():
     print("Ctrl+C to stop.", file=sys.stderr)
     while True:
         try:
-            out = api(token, "getUpdates", offset=offset, timeout=30)
+            out = api_get(
+                token, "getUpdates",
+                offset=offset, timeout=LONG_POLL_TIMEOUT, limit=100, allowed_updates=ALLOWED_UPDATES,
+            )
         except urllib.error.URLError as e:
             print("API error: %s" % e, file=sys.stderr)
             time.sleep(5)
@@ -538,6 +737,7 @@ def main():
         batch_texts = []
         batch_image_paths = []  # workspace-relative paths for agent
         batch_document_paths = []  # workspace-relative paths for agent (PDF etc.)
+        pending_downloads = []  # (file_id, dest_path, workspace path, batch list), downloaded in parallel below
         chat_id = None
         for i, upd in enumerate(updates):
             msg = upd.get("message") or upd.get("edited_message")
@@ -556,28 +756,33 @@ def main():
             if photos:
                 file_id = photos[-1].get("file_id")  # largest size
                 if file_id:
-                    os.makedirs(RECEIVED_IMAGES_DIR, exist_ok=True)
                     local_name = "photo_%s_%s.jpg" % (upd["update_id"], i)
                     dest_path = os.path.join(RECEIVED_IMAGES_DIR, local_name)
-                    if download_telegram_photo(token, file_id, dest_path):
-                        batch_image_paths.append(os.path.join("telegram-bot", "received_images", local_name))
+                    pending_downloads.append(
+                        (file_id, dest_path, os.path.join("telegram-bot", "received_images", local_name), batch_image_paths)
+                    )
                 caption = (msg.get("caption") or "").strip()
                 if caption:
                     batch_texts.append(caption)
             doc = msg.get("document")
             if isinstance(doc, dict) and doc.get("file_id"):
-                os.makedirs(RECEIVED_DOCUMENTS_DIR, exist_ok=True)
                 orig_name = doc.get("file_name") or "file"
                 safe = _safe_document_filename(orig_name)
                 local_name = "doc_%s_%s_%s" % (upd["update_id"], i, safe)
                 dest_path = os.path.join(RECEIVED_DOCUMENTS_DIR, local_name)
-                if download_telegram_file(token, doc["file_id"], dest_path):
-                    batch_document_paths.append(
-                        os.path.join("telegram-bot", "received_documents", local_name)
-                    )
+                pending_downloads.append(
+                    (doc["file_id"], dest_path, os.path.join("telegram-bot", "received_documents", local_name), batch_document_paths)
+                )
                 cap = (msg.get("caption") or "").strip()
                 if cap:
                     batch_texts.append(cap)
+        if pending_downloads:
+            # Each download is getFile + file GET; overlap photos and documents instead of paying the RTTs serially
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+                ok = list(ex.map(lambda p: download_telegram_file(token, p[0], p[1]), pending_downloads))
+            for (_, _, workspace_path, paths), done in zip(pending_downloads, ok):
+                if done:
+                    paths.append(workspace_path)
         # Advance offset past entire batch so we don't re-process
         offset = updates[-1]["update_id"] + 1
         save_offset(offset)
@@ -585,7 +790,7 @@ def main():
             continue
         if chat_id is None:
             continue
-        save_chat_id(chat_id)
+        save_chat_id(chat_id)  # no-op unless the chat_id changed
         # Concatenate all new messages into one prompt (e.g. 3 messages -> one agent run)
         text = "\n\n".join(batch_texts) if batch_texts else ""
         if batch_image_paths:
@@ -605,7 +810,7 @@ def main():
         else:
             print("Running agent for prompt: %s..." % text[:60], file=sys.stderr)
         send_chat_action(token, chat_id, "typing")
-        session_id = run_agent_streaming(text, session_id, token, chat_id)
+        session_id = run_agent_streaming(text, session_id, token, chat_id, get_agent_timeout())
         save_session(session_id)
 
 
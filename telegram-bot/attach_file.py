@@ -25,7 +25,7 @@ def main():
         print("Usage: attach_file.py <file> [file ...]", file=sys.stderr)
         sys.exit(1)
     os.makedirs(PENDING_ATTACHMENTS_DIR, mode=0o700, exist_ok=True)
-    stamp = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    stamp = f"{datetime.now():%Y-%m-%dT%H-%M-%S}_{os.getpid()}"  # pid: unique even within one second
     for i, src in enumerate(sys.argv[1:]):
         if not os.path.isfile(src):
             print("attach_file: not a file:", src, file=sys.stderr)
@@ -34,7 +34,7 @@ def main():
         name, ext = os.path.splitext(base)
         dest_name = f"{name}_{stamp}_{i}{ext}" if i else f"{name}_{stamp}{ext}"
         dest = os.path.join(PENDING_ATTACHMENTS_DIR, dest_name)
-        shutil.copy2(src, dest)
+        shutil.copyfile(src, dest)
         print(dest)
 
 
@@ -19,6 +19,7 @@ from datetime import datetime
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PENDING_IMAGES_DIR = os.path.join(SCRIPT_DIR, "pending_images")
+IMAGE_EXTENSIONS = frozenset((".png", ".jpg", ".jpeg", ".gif", ".webp"))  # same set agent_bot sends as photos
 
 
 def main():
@@ -26,19 +27,19 @@ def main():
         print("Usage: attach_image.py <image> [image ...]", file=sys.stderr)
         sys.exit(1)
     os.makedirs(PENDING_IMAGES_DIR, mode=0o700, exist_ok=True)
-    stamp = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    stamp = f"{datetime.now():%Y-%m-%dT%H-%M-%S}_{os.getpid()}"  # pid: unique even within one second
     for i, src in enumerate(sys.argv[1:]):
         if not os.path.isfile(src):
             print("attach_image: not a file:", src, file=sys.stderr)
             continue
         base = os.path.basename(src)
         name, ext = os.path.splitext(base)
-        if not ext or ext.lower() not in (".png", ".jpg", ".jpeg", ".gif", ".webp"):
+        if ext.lower() not in IMAGE_EXTENSIONS:
             print("attach_image: skipping non-image:", src, file=sys.stderr)
             continue
         dest_name = f"{name}_{stamp}_{i}{ext}" if i else f"{name}_{stamp}{ext}"
         dest = os.path.join(PENDING_IMAGES_DIR, dest_name)
-        shutil.copy2(src, dest)
+        shutil.copyfile(src, dest)
         print(dest)
 
 
@@ -14,7 +14,13 @@ import json
 import urllib.request
 import urllib.error
 
+try:
+    import orjson  # optional: faster JSON decoding of getUpdates responses
+except ImportError:
+    orjson = None
+
 BASE = "https://api.telegram.org/bot"
+_json_loads = orjson.loads if orjson is not None else json.loads  # both take the raw response bytes
 
 
 def get_token():
@@ -31,8 +37,9 @@ def api(token, method, **params):
     req = urllib.request.Request(url, data=data, method="POST" if data else "GET")
     if data:
         req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=60) as r:
-        return json.loads(r.read().decode())
+    # Socket timeout must outlast a getUpdates long-poll "timeout"
+    with urllib.request.urlopen(req, timeout=max(60, params.get("timeout", 0) + 10)) as r:
+        return _json_loads(r.read())
 
 
 def main():
@@ -42,7 +49,10 @@ def main():
     print("Ctrl+C to stop.", file=sys.stderr)
     while True:
         try:
-            out = api(token, "getUpdates", offset=offset, timeout=30)
+            out = api(
+                token, "getUpdates",
+                offset=offset, timeout=50, limit=100, allowed_updates=["message", "edited_message"],
+            )
         except urllib.error.URLError as e:
             print(f"API error: {e}", file=sys.stderr)
             time.sleep(5)
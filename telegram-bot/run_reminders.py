@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """
 Check reminders.json for due reminders and send them via Telegram.
+Run once per timer tick, or with --daemon to keep running and wake when one is due.
 If a reminder has "prompt", run the Cursor agent with that prompt and send its
 reply; otherwise send "text" as a fixed message. Uses the same config and
 chat_id as agent_bot.py (chat_id is written by the bot when you message it).
@@ -10,97 +11,57 @@ import os
 import sys
 import json
 import subprocess
-import urllib.request
-import urllib.error
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+from _common import SCRIPT_DIR, get_agent_timeout, json_loads, load_config, send_message
+
 REPO_ROOT = os.path.dirname(SCRIPT_DIR)
-CONFIG_FILE = os.path.join(SCRIPT_DIR, "config")
-CHAT_ID_FILE = os.path.join(SCRIPT_DIR, "chat_id")
 REMINDERS_FILE = os.path.join(SCRIPT_DIR, "reminders.json")
-BASE = "https://api.telegram.org/bot"
-DEFAULT_AGENT_TIMEOUT = 0  # 0 = unlimited
-
-
-def load_config():
-    """Return (token, chat_id) or (None, None) if missing."""
-    token = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "TELEGRAM_BOT_TOKEN" and v:
-                        token = v
-                        break
-    token = token or os.environ.get("TELEGRAM_BOT_TOKEN")
-    if not token:
-        return None, None
-    if not os.path.isfile(CHAT_ID_FILE):
-        return token, None
-    try:
-        with open(CHAT_ID_FILE) as f:
-            chat_id = int(f.read().strip())
-    except (ValueError, OSError):
-        return token, None
-    return token, chat_id
+REMINDER_WORKERS = 4  # due reminders handled at once (each prompt reminder is one agent process)
+RESULT_GRACE = 5  # seconds an agent may keep running after printing its result before it is terminated
+STDERR_TAIL = 65536  # bytes of agent stderr kept for the error reply
+DAEMON_POLL = 5  # --daemon: seconds between checks of reminders.json for edits
 
 
 def load_reminders():
-    if not os.path.isfile(REMINDERS_FILE):
-        return []
     try:
         with open(REMINDERS_FILE) as f:
             data = json.load(f)
-        return data.get("reminders", data) if isinstance(data, dict) else data
-    except (json.JSONDecodeError, OSError):
+    except (json.JSONDecodeError, OSError):  # includes FileNotFoundError: no reminders yet
         return []
+    return data.get("reminders", data) if isinstance(data, dict) else data
+
+
+def _reminders_mtime():
+    try:
+        st = os.stat(REMINDERS_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
 
 def save_reminders(reminders):
-    with open(REMINDERS_FILE, "w") as f:
-        json.dump({"reminders": reminders}, f, indent=2)
-
-
-def send_message(token, chat_id, text):
-    url = f"{BASE}{token}/sendMessage"
-    data = json.dumps({"chat_id": chat_id, "text": text}).encode()
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=10) as r:
-        return json.loads(r.read().decode())
-
-
-def get_agent_timeout():
-    """Agent subprocess timeout in seconds. Config or env CURSOR_AGENT_TIMEOUT, else default."""
-    timeout = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "CURSOR_AGENT_TIMEOUT" and v:
-                        try:
-                            timeout = int(v)
-                        except ValueError:
-                            pass
-                        break
-    if timeout is None:
-        try:
-            timeout = int(os.environ.get("CURSOR_AGENT_TIMEOUT", str(DEFAULT_AGENT_TIMEOUT)))
-        except ValueError:
-            timeout = DEFAULT_AGENT_TIMEOUT
-    return timeout if timeout > 0 else 0  # 0 = unlimited
+    """
+    Write reminders atomically (temp sibling + os.replace): a crash mid-write, or the
+    agent reading the file meanwhile, sees the old list or the new one, never half.
+    Returns the written file's _reminders_mtime() key, taken from the temp file itself
+    so an edit landing right after the replace isn't mistaken for this write.
+    """
+    tmp = REMINDERS_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"reminders": reminders}, f, indent=2)  # kept readable: edited by hand and by the agent
+        f.flush()
+        os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    os.replace(tmp, REMINDERS_FILE)  # a rename: the file's mtime and size are unchanged
+    return (st.st_mtime_ns, st.st_size)
+
 
+_REPLY_KEYS = (b'"result"', b'"text"', b'"content"', b'"response"', b'"message"', b'"output"')  # keys a reply is read from
 
 REMINDER_INSTRUCTION = (
     " [Your reply will be sent to the user on Telegram. "
@@ -123,62 +84,154 @@ def run_agent_prompt(prompt):
     cmd.append(full_prompt)
     timeout_sec = get_agent_timeout()
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
             cwd=REPO_ROOT,
-            capture_output=True,
-            text=True,
-            timeout=timeout_sec or None,  # 0 = unlimited
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
         )
-        out = (result.stdout or "").strip()
-        err = (result.stderr or "").strip()
+    except Exception as e:
+        return "Error running agent: %s" % e
+    # Drain stderr concurrently so a chatty agent can't block on a full pipe; only its
+    # tail is kept, as it is just the fallback reply when the agent fails
+    err_chunks = []
+
+    def drain_stderr():
+        tail = b""
+        while True:
+            chunk = proc.stderr.read1(65536)
+            if not chunk:
+                break
+            tail = (tail + chunk)[-STDERR_TAIL:]
+        err_chunks.append(tail)
+
+    drainer = threading.Thread(target=drain_stderr, daemon=True)
+    drainer.start()
+    timed_out = threading.Event()
+
+    def kill_on_timeout():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout_sec, kill_on_timeout) if timeout_sec else None  # 0 = unlimited
+    if timer:
+        timer.daemon = True
+        timer.start()
+    try:
+        out_lines = []  # raw output, kept only until some line parses as JSON
+        any_parsed = False
         response_text = None
-        for line in out.splitlines():
+        have_result = False
+        for line in proc.stdout:
+            if not any_parsed:
+                out_lines.append(line)
             line = line.strip()
             if not line:
                 continue
+            if line[:1] != b"{":
+                continue  # log/progress text, not a JSON object
+            if response_text is not None and b'"result"' not in line:
+                continue  # already have a fallback reply; only a result line can replace it
+            if any_parsed and not any(k in line for k in _REPLY_KEYS):
+                continue  # JSON, but nothing this loop would use
             try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
+                obj = json_loads(line)
+            except ValueError:  # JSONDecodeError, or UnicodeDecodeError on non-UTF-8 bytes
                 continue
-            if "result" in obj and isinstance(obj["result"], str):
-                response_text = obj["result"].strip()
+            if not any_parsed:
+                any_parsed = True
+                out_lines = []
+            result = obj.get("result")
+            if isinstance(result, dict):
+                result = result.get("content", str(result))
+            if isinstance(result, str):
+                response_text = result.strip()
+                have_result = True
                 break
             if response_text is None:
                 for key in ("text", "content", "response", "message", "output"):
                     if key in obj and isinstance(obj[key], str):
                         response_text = obj[key]
                         break
-        if response_text is None and out:
+        if have_result:
+            # The reply is all we need; give the agent a moment to exit cleanly, then stop it
+            try:
+                proc.wait(timeout=RESULT_GRACE)
+            except subprocess.TimeoutExpired:
+                proc.terminate()
+        returncode = proc.wait()
+        drainer.join(RESULT_GRACE)  # a leftover grandchild may hold stderr open; don't wait on it
+        if timed_out.is_set() and not have_result:
+            return "Agent timed out after %d seconds." % timeout_sec
+        # Output is read as bytes and json_loads parses bytes directly; only text we return is decoded
+        out = b"".join(out_lines).strip().decode("utf-8", "replace")
+        err = b"".join(err_chunks).strip().decode("utf-8", "replace")
+        if response_text is None and not any_parsed and out:
+            # No single line parsed: try the output as one JSON document (e.g. pretty-printed),
+            # else pass the raw text through
             try:
-                obj = json.loads(out)
+                obj = json_loads(out)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
                 response_text = obj.get("result") or obj.get("text") or obj.get("content") or out
                 if isinstance(response_text, dict):
                     response_text = response_text.get("content", str(response_text))
-            except json.JSONDecodeError:
+            else:
                 response_text = out
-        if not response_text and result.returncode != 0:
-            response_text = err or "Agent exited with code %s" % result.returncode
+        if not response_text and returncode != 0:
+            response_text = err or "Agent exited with code %s" % returncode
         return response_text or "(no output)"
-    except subprocess.TimeoutExpired:
-        return "Agent timed out after %d seconds." % timeout_sec
     except Exception as e:
+        proc.kill()
         return "Error running agent: %s" % e
+    finally:
+        if timer:
+            timer.cancel()
 
 
-def main():
-    token, chat_id = load_config()
-    if not token:
-        print("run_reminders: no token", file=sys.stderr)
-        sys.exit(0)
-    if chat_id is None:
-        print("run_reminders: no chat_id (message the bot once)", file=sys.stderr)
-        sys.exit(0)
-    now = datetime.now()
-    reminders = load_reminders()
+@lru_cache(maxsize=1024)
+def parse_at(at_str):
+    """
+    Parse a reminder's "at" (ISO 8601) as a naive local datetime, comparable with
+    datetime.now(). Naive strings, the usual case, skip the timezone conversion.
+    Memoized, so --daemon doesn't re-parse unchanged entries on every wake.
+    """
+    if at_str[-1:] == "Z":
+        at_str = at_str[:-1] + "+00:00"  # fromisoformat only accepts "Z" from Python 3.11
+    at = datetime.fromisoformat(at_str)
+    if at.tzinfo is None:
+        return at
+    return at.astimezone().replace(tzinfo=None)
+
+
+def deliver_reminder(token, chat_id, r):
+    """Send one due reminder: the agent's reply to its "prompt", else its fixed "text"."""
+    try:
+        if r.get("prompt"):
+            body = run_agent_prompt(r["prompt"])
+            send_message(token, chat_id, "⏰ " + body)
+            print("Sent prompt reminder (%d chars)" % len(body), file=sys.stderr)
+        else:
+            text = r.get("text") or "(reminder)"
+            send_message(token, chat_id, "⏰ " + text)
+            print("Sent text reminder: %s" % text[:50], file=sys.stderr)
+    except Exception as e:
+        print("Failed to send reminder: %s" % e, file=sys.stderr)
+
+
+def take_due(now):
+    """
+    Remove the reminders due at `now` from reminders.json and return (due, next_at, mtime):
+    next_at is the earliest "at" still pending (None if nothing is scheduled), and mtime
+    is the _reminders_mtime() of the version the result reflects. It is taken before
+    reading, or from our own rewrite, so an edit made meanwhile still looks like a change.
+    """
+    mtime = _reminders_mtime()
     due = []
     remaining = []
-    for r in reminders:
+    next_at = None
+    for r in load_reminders():
         if not isinstance(r, dict):
             remaining.append(r)
             continue
@@ -187,9 +240,7 @@ def main():
             remaining.append(r)
             continue
         try:
-            at = datetime.fromisoformat(at_str.replace("Z", "+00:00"))
-            if at.tzinfo:
-                at = at.astimezone().replace(tzinfo=None)  # to local naive for comparison with now
+            at = parse_at(at_str)
         except (ValueError, TypeError):
             remaining.append(r)
             continue
@@ -197,22 +248,77 @@ def main():
             due.append(r)
         else:
             remaining.append(r)
+            if next_at is None or at < next_at:
+                next_at = at
     # Remove due reminders from file immediately so the next timer run won't process them again
     # (prompt-based reminders can take minutes; we don't want two agent runs for the same reminder)
     if due:
-        save_reminders(remaining)
+        mtime = save_reminders(remaining)
+    return due, next_at, mtime
+
+
+def _dedup_prompts(due):
+    """
+    Drop prompt reminders whose prompt already came up earlier in `due`: they all go to
+    the one chat, so a single agent run and reply covers them. Text reminders are kept.
+    """
+    seen = set()
+    out = []
     for r in due:
-        try:
-            if r.get("prompt"):
-                body = run_agent_prompt(r["prompt"])
-                send_message(token, chat_id, "⏰ " + body)
-                print("Sent prompt reminder (%d chars)" % len(body), file=sys.stderr)
-            else:
-                text = r.get("text") or "(reminder)"
-                send_message(token, chat_id, "⏰ " + text)
-                print("Sent text reminder: %s" % text[:50], file=sys.stderr)
-        except Exception as e:
-            print("Failed to send reminder: %s" % e, file=sys.stderr)
+        prompt = r.get("prompt")
+        if prompt:
+            key = prompt.strip()
+            if key in seen:
+                print("Skipped duplicate prompt reminder", file=sys.stderr)
+                continue
+            seen.add(key)
+        out.append(r)
+    return out
+
+
+def run_daemon(token, chat_id):
+    """
+    --daemon: stay running instead of being started every minute by the timer. Sleeps
+    until the next reminder is due, waking every DAEMON_POLL seconds to pick up edits to
+    reminders.json; sends reuse the one kept-alive connection while Telegram keeps it open.
+    """
+    with ThreadPoolExecutor(max_workers=REMINDER_WORKERS) as ex:
+        while True:
+            due, next_at, mtime = take_due(datetime.now())
+            for r in _dedup_prompts(due):
+                ex.submit(deliver_reminder, token, chat_id, r)
+            while True:
+                wait = DAEMON_POLL
+                if next_at is not None:
+                    wait = min(wait, (next_at - datetime.now()).total_seconds())
+                if wait > 0:
+                    time.sleep(wait)
+                if next_at is not None and datetime.now() >= next_at:
+                    break
+                if _reminders_mtime() != mtime:
+                    break
+
+
+def main():
+    token, chat_id = load_config()
+    if not token:
+        print("run_reminders: no token", file=sys.stderr)
+        sys.exit(0)
+    if chat_id is None:
+        print("run_reminders: no chat_id (message the bot once)", file=sys.stderr)
+        sys.exit(0)
+    if "--daemon" in sys.argv[1:]:
+        run_daemon(token, chat_id)
+        return
+    due, _, _ = take_due(datetime.now())
+    due = _dedup_prompts(due)
+    if not due:
+        return
+    # Each reminder is sent as soon as it is ready, so text reminders and quick prompts
+    # don't wait behind a slow agent run; sends share the one kept-alive connection.
+    with ThreadPoolExecutor(max_workers=min(REMINDER_WORKERS, len(due))) as ex:
+        for r in due:
+            ex.submit(deliver_reminder, token, chat_id, r)
 
 
 if __name__ == "__main__":
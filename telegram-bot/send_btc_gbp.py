@@ -4,57 +4,65 @@
 import os
 import sys
 import json
-import urllib.request
+import time
 import urllib.error
+import urllib.request
+from datetime import datetime
+
+from _common import SCRIPT_DIR, load_config, send_message
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(SCRIPT_DIR, "config")
-CHAT_ID_FILE = os.path.join(SCRIPT_DIR, "chat_id")
-BASE = "https://api.telegram.org/bot"
 COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=gbp"
+CACHE_FILE = os.path.join(SCRIPT_DIR, ".btc_gbp_cache.json")
+CACHE_TTL = 60  # seconds a fetched price is reused without asking CoinGecko again
+STALE_MAX = 3 * 3600  # oldest cached price sent, labelled, when CoinGecko is unreachable
 
 
-def load_config():
-    """Return (token, chat_id) or (None, None) if missing."""
-    token = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "TELEGRAM_BOT_TOKEN" and v:
-                        token = v
-                        break
-    token = token or os.environ.get("TELEGRAM_BOT_TOKEN")
-    if not token:
-        return None, None
-    if not os.path.isfile(CHAT_ID_FILE):
-        return token, None
+def _load_cache():
+    """Last fetched {"ts", "price", "etag"}, or {} if there is none."""
     try:
-        with open(CHAT_ID_FILE) as f:
-            chat_id = int(f.read().strip())
-    except (ValueError, OSError):
-        return token, None
-    return token, chat_id
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
 
 
-def fetch_btc_gbp():
-    with urllib.request.urlopen(COINGECKO_URL, timeout=10) as r:
-        data = json.loads(r.read().decode())
-    return data.get("bitcoin", {}).get("gbp")
+def _save_cache(cache):
+    tmp = CACHE_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass  # the cache only saves a request; sending the price matters more
 
 
-def send_message(token, chat_id, text):
-    url = f"{BASE}{token}/sendMessage"
-    data = json.dumps({"chat_id": chat_id, "text": text}).encode()
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=10) as r:
-        return json.loads(r.read().decode())
+def fetch_btc_gbp():
+    """Return (price, ts): BTC price in GBP and when CoinGecko last confirmed it (see CACHE_TTL, STALE_MAX)."""
+    cache = _load_cache()
+    now = time.time()
+    price = cache.get("price")
+    if price is not None and now - cache.get("ts", 0) < CACHE_TTL:
+        return price, cache["ts"]
+    req = urllib.request.Request(COINGECKO_URL)
+    if price is not None and cache.get("etag"):
+        req.add_header("If-None-Match", cache["etag"])
+    try:
+        with urllib.request.urlopen(req, timeout=10) as r:
+            data = json.loads(r.read().decode())
+            etag = r.headers.get("ETag")
+    except (urllib.error.URLError, OSError, ValueError) as e:  # HTTPError is a URLError
+        if price is not None and getattr(e, "code", None) == 304:  # urlopen raises for 304: cached price is current
+            cache["ts"] = now
+            _save_cache(cache)
+            return price, now
+        if price is None or now - cache.get("ts", 0) > STALE_MAX:
+            raise
+        return price, cache.get("ts", 0)
+    price = data.get("bitcoin", {}).get("gbp")
+    if price is not None:
+        _save_cache({"ts": now, "price": price, "etag": etag})
+    return price, now
 
 
 def main():
@@ -66,7 +74,7 @@ def main():
         print("send_btc_gbp: no chat_id (message the bot once first)", file=sys.stderr)
         sys.exit(1)
     try:
-        price = fetch_btc_gbp()
+        price, ts = fetch_btc_gbp()
     except Exception as e:
         print("send_btc_gbp: failed to fetch BTC price:", e, file=sys.stderr)
         sys.exit(1)
@@ -74,6 +82,10 @@ def main():
         print("send_btc_gbp: no GBP price in API response", file=sys.stderr)
         sys.exit(1)
     message = "BTC: £{:,.0f}".format(price)
+    if time.time() - ts > CACHE_TTL:  # CoinGecko unreachable: say how old the price is
+        as_of = datetime.fromtimestamp(ts)
+        fmt = "%H:%M" if as_of.date() == datetime.now().date() else "%d %b %H:%M"
+        message += " (as of {})".format(as_of.strftime(fmt))
     try:
         send_message(token, chat_id, message)
     except Exception as e:
@@ -1,52 +1,9 @@
 #!/usr/bin/env python3
 """Send a short HN digest to the user on Telegram. Uses same config and chat_id as agent_bot."""
 
-import os
 import sys
-import json
-import urllib.request
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(SCRIPT_DIR, "config")
-CHAT_ID_FILE = os.path.join(SCRIPT_DIR, "chat_id")
-BASE = "https://api.telegram.org/bot"
-
-
-def load_config():
-    """Return (token, chat_id) or (None, None) if missing."""
-    token = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "TELEGRAM_BOT_TOKEN" and v:
-                        token = v
-                        break
-    token = token or os.environ.get("TELEGRAM_BOT_TOKEN")
-    if not token:
-        return None, None
-    if not os.path.isfile(CHAT_ID_FILE):
-        return token, None
-    try:
-        with open(CHAT_ID_FILE) as f:
-            chat_id = int(f.read().strip())
-    except (ValueError, OSError):
-        return token, None
-    return token, chat_id
-
-
-def send_message(token, chat_id, text):
-    url = f"{BASE}{token}/sendMessage"
-    data = json.dumps({"chat_id": chat_id, "text": text}).encode()
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=10) as r:
-        return json.loads(r.read().decode())
+from _common import load_config, send_message
 
 
 def main():
@@ -8,40 +8,10 @@ import os
 import sys
 import urllib.request
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(SCRIPT_DIR, "config")
-CHAT_ID_FILE = os.path.join(SCRIPT_DIR, "chat_id")
-BASE = "https://api.telegram.org/bot"
-
-
-def load_token_and_chat():
-    token = None
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    k, v = k.strip(), v.strip().strip("'\"")
-                    if k == "TELEGRAM_BOT_TOKEN" and v:
-                        token = v
-                        break
-    token = token or os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = None
-    if os.path.isfile(CHAT_ID_FILE):
-        try:
-            with open(CHAT_ID_FILE) as f:
-                chat_id = int(f.read().strip())
-        except (ValueError, OSError):
-            pass
-    return token, chat_id
+from _common import BASE, load_config
 
 
 def send_photo(token: str, chat_id: int, photo_path: str, caption: str | None = None) -> None:
-    if not os.path.isfile(photo_path):
-        raise FileNotFoundError(photo_path)
     url = "%s%s/sendPhoto" % (BASE, token)
     with open(photo_path, "rb") as f:
         photo_data = f.read()
@@ -80,7 +50,7 @@ def main() -> None:
         sys.exit(1)
     path = sys.argv[1]
     caption = " ".join(sys.argv[2:]) if len(sys.argv) > 2 else None
-    token, chat_id = load_token_and_chat()
+    token, chat_id = load_config()
     if not token:
         print("send_photo_now: missing TELEGRAM_BOT_TOKEN", file=sys.stderr)
         sys.exit(1)